@@ -14,9 +14,9 @@ https://colab.research.google.com/github/benihime91/pytorch_retinanet/blob/maste
 """
 import os
 import pandas as pd
-from skimage import io
 from torch.utils.data import Dataset
 from deepforest import transforms as T
+from deepforest import utilities
 
 def get_transform(augment):
     transforms = []
@@ -41,27 +41,34 @@ class TreeDataset(Dataset):
         self.annotations = pd.read_csv(csv_file)
         self.root_dir = root_dir
         self.transform = transforms
+
+        #Group boxes and labels by image once, so __getitem__ indexes
+        #pre-built arrays instead of scanning the annotation frame per access
+        self.image_groups = []
+        for image_name, group in self.annotations.groupby("image_path", sort=False):
+            boxes = group[["xmin", "ymin", "xmax", "ymax"]].values.astype(float)
+
+            #Labels need to be encoded? 0 or 1 indexed?, ALl tree for the moment.
+            labels = group.label.apply(lambda x: idx_to_label[x]).values.astype(int)
+            self.image_groups.append((image_name, boxes, labels))
+
         self.image_names = self.annotations.image_path.unique()
 
     def __len__(self):
-        return len(self.image_names)
+        return len(self.image_groups)
 
     def __getitem__(self, idx):
-        img_name = os.path.join(self.root_dir, self.image_names[idx])
-        image = io.imread(img_name)
-        image = image/255   
-        
-        #select annotations
-        image_annotations = self.annotations[self.annotations.image_path ==
-                                             self.image_names[idx]]
+        image_name, boxes, labels = self.image_groups[idx]
+        img_name = os.path.join(self.root_dir, image_name)
+        image = utilities.read_image(img_name)
+        image = image/255
+
+        #copy so transforms cannot mutate the cached arrays in place
         targets = {}
-        targets["boxes"] = image_annotations[["xmin", "ymin", "xmax",
-                                   "ymax"]].values.astype(float)
-        
-        #Labels need to be encoded? 0 or 1 indexed?, ALl tree for the moment.
-        targets["labels"] = image_annotations.label.apply(lambda x: idx_to_label[x]).values.astype(int)
+        targets["boxes"] = boxes.copy()
+        targets["labels"] = labels.copy()
 
         if self.transform:
             image, targets = self.transform(image, targets)
 
-        return self.image_names[idx], image, targets
\ No newline at end of file
+        return image_name, image, targets
\ No newline at end of file
@@ -1,8 +1,9 @@
 #entry point for deepforest model
+import copy
 import os
+import warnings
 import numpy as np
 import pandas as pd
-from skimage import io
 import torch
 
 import pytorch_lightning as pl
@@ -41,10 +42,20 @@ class deepforest(pl.LightningModule):
                     "directory or in installed package location. {}".format(e))
 
         print("Reading config file: {}".format(config_path))
-        self.config = utilities.read_config(config_path)
+
+        #Reuse the parsed config while the file is unchanged, deep copying so
+        #each instance can mutate its config independently
+        mtime = os.path.getmtime(config_path)
+        self.config = copy.deepcopy(utilities._cached_read_config(config_path, mtime))
 
         # release version id to flag if release is being used
         self.__release_version__ = None
+
+        # cache of parsed annotation csvs, keyed by path
+        self._csv_cache = {}
+
+        # optional compiled copy of the model, see compile_for_inference
+        self.scripted_model = None
         
         if saved_model:
             utilities.load_saved_model(saved_model)                
@@ -64,31 +75,114 @@ class deepforest(pl.LightningModule):
         # load saved model and tag release
         self.__release_version__ = release_tag
         print("Loading pre-built model: {}".format(release_tag))
+
+        # place on device once at load time, not per prediction call
+        self.model.to(self.device)
     
     def create_model(self):
         """Define a deepforest retinanet architecture"""
         self.model = model.create_model(self.num_classes)
+
+        #channels_last lets conv kernels use the faster NHWC layout on tensor core gpus
+        self.model = self.model.to(memory_format=torch.channels_last)
+
+        #place on device once, prediction calls assume the model is already there
+        self.model.to(self.device)
     
+    def compile_for_inference(self, backend="torchscript"):
+        """Build an optimized copy of the model for the predict paths
+
+        The compiled model is stored on self.scripted_model and used by
+        predict_image and predict_tile in place of the eager model. Scripted
+        detection models accept a list of image tensors of any size and return
+        a (losses, detections) tuple, which predict handles internally.
+
+        Shape specialized backends such as tensorrt are not supported: the
+        detection model's forward takes a variable-length list of
+        variable-size images, which cannot be bound to a fixed-shape engine.
+
+        Args:
+            backend: "torchscript" scripts the model, torchvision detection models
+                support scripting but not tracing.
+        Returns:
+            scripted_model: the compiled model
+        """
+        self.model.eval()
+
+        if backend == "torchscript":
+            scripted = torch.jit.script(self.model)
+            try:
+                scripted = torch.jit.optimize_for_inference(torch.jit.freeze(scripted))
+            except Exception as e:
+                warnings.warn("Scripted model could not be frozen, "
+                              "continuing with the unfrozen script: {}".format(e))
+            self.scripted_model = scripted
+        else:
+            raise ValueError("backend must be 'torchscript', received {}".format(backend))
+
+        return self.scripted_model
+
     def create_trainer(self, logger=None, callbacks=None, **kwargs):
         """Create a pytorch ligthning training by reading config files
         Args:
             callbacks (list): a list of pytorch-lightning callback classes
         """
         
+        #Prefer ddp, each gpu runs in its own process. The legacy dp backend is
+        #slower (single process, gil bound) and memory unbalanced.
+        strategy = self.config.get("strategy")
+        if strategy is None:
+            strategy = self.config.get("distributed_backend")
+        if strategy == "dp":
+            warnings.warn("distributed strategy 'dp' is deprecated in favor of 'ddp', "
+                          "which scales near-linearly with gpu count. Using ddp.")
+            strategy = "ddp"
+
+        distributed_args = {}
+        if strategy is None and self.config["gpus"] and self.config["gpus"] != 1:
+            strategy = "ddp"
+        if strategy is not None:
+            distributed_args = {"distributed_backend": strategy, "sync_batchnorm": True}
+
         self.trainer = pl.Trainer(
             logger=logger,
             max_epochs=self.config["train"]["epochs"],
             gpus=self.config["gpus"],
             checkpoint_callback=False,
-            distributed_backend=self.config["distributed_backend"],
             fast_dev_run=self.config["train"]["fast_dev_run"],
+            precision=self.config.get("precision", 32),
             callbacks=callbacks,
+            **distributed_args,
             **kwargs
-        )        
+        )
     
     def run_train(self):
         self.trainer.fit(self)
 
+    def _read_csv_cached(self, csv_file):
+        """Read an annotation csv, reusing the parsed frame while the file is unchanged
+
+        Validation runs re-read the same ground truth every epoch, caching on
+        modification time avoids re-parsing. Box coordinates are parsed
+        directly to float32 to halve memory over the float64 default.
+
+        Args:
+            csv_file: path to csv file
+        Returns:
+            df: a copy of the parsed dataframe, safe for callers to mutate
+        """
+        mtime = os.path.getmtime(csv_file)
+        cached = self._csv_cache.get(csv_file)
+
+        if cached is None or not cached[0] == mtime:
+            df = pd.read_csv(csv_file,
+                             engine="c",
+                             dtype={"xmin": np.float32, "ymin": np.float32,
+                                    "xmax": np.float32, "ymax": np.float32})
+            self._csv_cache[csv_file] = (mtime, df)
+
+        return self._csv_cache[csv_file][1].copy()
+
     def load_dataset(self, csv_file, root_dir=None, augment=False, shuffle=True, batch_size=1):
         """Create a tree dataset for inference
         Csv file format is .csv file with the columns "image_path", "xmin","ymin","xmax","ymax" for the image name and bounding box position. 
@@ -105,13 +199,29 @@ class deepforest(pl.LightningModule):
         ds = dataset.TreeDataset(csv_file=csv_file,
                               root_dir=root_dir,
                               transforms=dataset.get_transform(augment=augment))
-        
+
+        num_workers = self.config["workers"]
+        if num_workers is None:
+            num_workers = utilities.suggest_workers()
+        elif num_workers > (os.cpu_count() or 1):
+            warnings.warn("config workers ({}) exceeds the available cpus ({}), "
+                          "extra workers contend for cores and can slow the input pipeline".format(
+                              num_workers, os.cpu_count()))
+
+        #Worker persistence and prefetch depth only apply to multiprocess loading
+        worker_args = {}
+        if num_workers > 0:
+            worker_args = {"persistent_workers": True,
+                           "prefetch_factor": self.config.get("prefetch_factor", 4)}
+
         data_loader = torch.utils.data.DataLoader(ds,
                                                   batch_size=batch_size,
                                                   shuffle=shuffle,
-                                                  collate_fn=utilities.collate_fn,
-                                                  num_workers=self.config["workers"])
-        
+                                                  collate_fn=utilities.fast_collate,
+                                                  pin_memory=torch.cuda.is_available(),
+                                                  num_workers=num_workers,
+                                                  **worker_args)
+
         return data_loader
     
     def train_dataloader(self):
@@ -146,40 +256,81 @@ class deepforest(pl.LightningModule):
   
         if path:
             if not isinstance(path,str):
-                raise ValueError("Path expects a string path to image on disk")            
-            image = io.imread(path)
-        
-            #Load on GPU is available
-        if torch.cuda.is_available:
-            self.model.to(self.device)   
-            
-        self.model.eval()   
-        
+                raise ValueError("Path expects a string path to image on disk")
+            #Decoding happens inside predict on a direct-to-tensor fast path
+            image = path
+
+        #The model was placed on device at creation/load time. Re-calling
+        #.to() here would walk the full parameter graph on every patch.
+        if self.model.training:
+            self.model.eval()
+
+
+        #Use the compiled model when one has been built
+        inference_model = self.scripted_model if self.scripted_model is not None else self.model
+
         #Check if GPU is available and pass image to gpu
-        result = predict.predict_image(model =  self.model, image = image, return_plot = return_plot, score_threshold = score_threshold, device=self.device)
+        result = predict.predict_image(model =  inference_model, image = image, return_plot = return_plot, score_threshold = score_threshold, device=self.device)
         
         return result
                                                  
-    def predict_file(self, csv_file, root_dir, savedir=None):
+    def predict_file(self, csv_file, root_dir, savedir=None, use_trainer=False):
         """Create a dataset and predict entire annotation file
-        
-        Csv file format is .csv file with the columns "image_path", "xmin","ymin","xmax","ymax" for the image name and bounding box position. 
-        Image_path is the relative filename, not absolute path, which is in the root_dir directory. One bounding box per line. 
-        
+
+        Csv file format is .csv file with the columns "image_path", "xmin","ymin","xmax","ymax" for the image name and bounding box position.
+        Image_path is the relative filename, not absolute path, which is in the root_dir directory. One bounding box per line.
+
         Args:
-            csv_file: path to csv file 
+            csv_file: path to csv file
             root_dir: directory of images. If none, uses "image_dir" in config
             savedir: Optional. Directory to save image plots.
+            use_trainer: run prediction through self.trainer.test rather than a direct
+                loop over the dataloader. Only needed for multi-gpu evaluation, the
+                direct loop avoids per-call trainer setup cost.
         Returns:
             df: pandas dataframe with bounding boxes, label and scores for each image in the csv file
         """
-        
-        loader = self.load_dataset(csv_file=csv_file, root_dir=root_dir, batch_size=self.config["batch_size"])
-        df = self.trainer.test(self, loader)
-        result = df[0]["gathered_results"]
-        
+
+        loader = self.load_dataset(csv_file=csv_file, root_dir=root_dir, shuffle=False, batch_size=self.config["batch_size"])
+
+        if use_trainer:
+            df = self.trainer.test(self, loader)
+            result = df[0]["gathered_results"]
+        else:
+            if self.model.training:
+                self.model.eval()
+
+            boxes_list = []
+            labels_list = []
+            scores_list = []
+            paths_list = []
+            for batch in loader:
+                path, images, targets = batch
+                images = [image.to(self.device, non_blocking=True) for image in images]
+
+                with torch.inference_mode():
+                    predictions = self.model(images)
+
+                for index, prediction in enumerate(predictions):
+                    image_boxes = prediction["boxes"].cpu().numpy()
+                    boxes_list.append(image_boxes)
+                    labels_list.append(prediction["labels"].cpu().numpy())
+                    scores_list.append(prediction["scores"].cpu().numpy())
+                    paths_list.extend([path[index]] * image_boxes.shape[0])
+
+            boxes = np.concatenate(boxes_list)
+            result = pd.DataFrame({
+                "xmin": boxes[:, 0],
+                "ymin": boxes[:, 1],
+                "xmax": boxes[:, 2],
+                "ymax": boxes[:, 3],
+                "label": np.concatenate(labels_list),
+                "scores": np.concatenate(scores_list),
+                "image_path": paths_list
+            })
+
         if savedir:
-            ground_truth = pd.read_csv(csv_file)
+            ground_truth = self._read_csv_cached(csv_file)
             utilities.check_file(ground_truth)
             visualize.plot_prediction_dataframe(result, ground_truth=ground_truth, root_dir=root_dir, savedir=savedir)
             
@@ -195,7 +346,8 @@ class deepforest(pl.LightningModule):
                      return_plot=False,
                      use_soft_nms = False,
                      sigma = 0.5,
-                     thresh = 0.001):
+                     thresh = 0.001,
+                     tile_batch_size = None):
         """For images too large to input into the model, predict_tile cuts the
         image into overlapping windows, predicts trees on each window and
         reassambles into a single array.
@@ -210,19 +362,27 @@ class deepforest(pl.LightningModule):
                 windows to be suppressed. Defaults to 0.5.
                 Lower values suppress more boxes at edges.
             return_plot: Should the image be returned with the predictions drawn?
-            use_soft_nms: whether to perform Gaussian Soft NMS or not, if false, default perform NMS. 
+            use_soft_nms: whether to perform Gaussian Soft NMS or not, if false, default perform NMS.
             sigma: variance of Gaussian function used in Gaussian Soft NMS
             thresh: the score thresh used to filter bboxes after soft-nms performed
-        
+            tile_batch_size: number of windows to predict in a single forward pass. If None, uses "tile_batch_size" in config
+
         Returns:
             boxes (array): if return_plot, an image.
             Otherwise a numpy array of predicted bounding boxes, scores and labels
         """
         
-        self.model.eval()
+        if self.model.training:
+            self.model.eval()
+
+        if tile_batch_size is None:
+            tile_batch_size = self.config.get("tile_batch_size", 8)
+
+        #Use the compiled model when one has been built
+        inference_model = self.scripted_model if self.scripted_model is not None else self.model
 
         result = predict.predict_tile(
-            model = self.model,
+            model = inference_model,
             raster_path=raster_path,
             image=image,
             patch_size=patch_size,
@@ -233,6 +393,7 @@ class deepforest(pl.LightningModule):
             use_soft_nms = use_soft_nms,
             sigma = sigma,
             thresh = thresh,
+            tile_batch_size = tile_batch_size,
             device=self.device
         )
         
@@ -242,12 +403,19 @@ class deepforest(pl.LightningModule):
         """Train on a loaded dataset
         """        
         path, images, targets = batch
-        
+
+        #Pinned batches can be copied to the gpu asynchronously
+        images = [image.to(self.device, non_blocking=True) for image in images]
+        targets = [{key: value.to(self.device, non_blocking=True) for key, value in target.items()} for target in targets]
+
+        #Mixed precision is driven by the "precision" config key, lightning
+        #pairs autocast with a grad scaler when precision is 16
         loss_dict = self.model.forward(images, targets)
-        
-        #sum of regression and classification loss        
-        losses = sum([loss for loss in loss_dict.values()])
-        
+
+        #sum of regression and classification loss in a single reduce kernel,
+        #rather than chained adds which each launch their own
+        losses = torch.stack(list(loss_dict.values())).sum()
+
         return losses
     
     def validation_step(self, batch, batch_idx):
@@ -255,14 +423,18 @@ class deepforest(pl.LightningModule):
 
         """
         path, images, targets = batch
-        
+
+        images = [image.to(self.device, non_blocking=True) for image in images]
+        targets = [{key: value.to(self.device, non_blocking=True) for key, value in target.items()} for target in targets]
+
         self.model.train()
         loss_dict = self.model.forward(images, targets)
         
         #sum of regression and classification loss
-        losses = sum([loss for loss in loss_dict.values()])
-        
+        losses = torch.stack(list(loss_dict.values())).sum()
+
         #Log loss
+        self.log("val_loss", losses, on_epoch=True)
         for key, value in loss_dict.items():
             self.log("val_{}".format(key),value, on_epoch=True)
                 
@@ -270,25 +442,46 @@ class deepforest(pl.LightningModule):
     
     def test_step(self, batch, batch_idx):
         path, images, targets = batch
-        predictions = self.model.forward(images)
-        
-        result = []
+
+        images = [image.to(self.device, non_blocking=True) for image in images]
+
+        with torch.inference_mode():
+            predictions = self.model.forward(images)
+
+        #Accumulate raw arrays and build a single dataframe at the end,
+        #rather than one small frame per image followed by a concat
+        boxes = []
+        labels = []
+        scores = []
+        paths = []
         for index, prediction in enumerate(predictions):
-            formatted_prediction = visualize.format_predictions(prediction)
-            formatted_prediction["image_path"] = path[index]
-            result.append(formatted_prediction)
-        result = pd.concat(result)
-        
-        return {"predictions":result}
+            image_boxes = prediction["boxes"].cpu().detach().numpy()
+            boxes.append(image_boxes)
+            labels.append(prediction["labels"].cpu().detach().numpy())
+            scores.append(prediction["scores"].cpu().detach().numpy())
+            paths.extend([path[index]] * image_boxes.shape[0])
+
+        #Return raw arrays, test_epoch_end builds the one dataframe
+        boxes = np.concatenate(boxes)
+
+        return {
+            "xmin": boxes[:, 0],
+            "ymin": boxes[:, 1],
+            "xmax": boxes[:, 2],
+            "ymax": boxes[:, 3],
+            "label": np.concatenate(labels),
+            "scores": np.concatenate(scores),
+            "image_path": np.array(paths, dtype=object)
+        }
     
     def test_epoch_end(self, outputs):
         """At the end of testing loop, gather all outputs into a single dataframe"""
-        gathered = list()
-        for batch in outputs:
-            gathered.append(batch["predictions"])
-        gathered = pd.concat(gathered)
+        #One concatenate per column and a single dataframe allocation, rather
+        #than one frame per batch followed by pd.concat
+        columns = {key: np.concatenate([batch[key] for batch in outputs]) for key in outputs[0]}
+        gathered = pd.DataFrame(columns)
         
-        ground_df = pd.read_csv(self.config["validation"]["csv_file"])
+        ground_df = self._read_csv_cached(self.config["validation"]["csv_file"])
         
         precision, recall = evaluate_iou.evaluate(
             predictions=gathered,
@@ -316,8 +509,19 @@ class deepforest(pl.LightningModule):
 
         return {'avg_val_loss': avg_loss, 'log': comet_logs}
         
+    def optimizer_zero_grad(self, epoch, batch_idx, optimizer, optimizer_idx):
+        #Freeing grads instead of writing zeros skips a full kernel pass over
+        #every parameter tensor each step
+        optimizer.zero_grad(set_to_none=True)
+
     def configure_optimizers(self):
-        self.optimizer = optim.SGD(self.model.parameters(), lr=self.config["train"]["lr"], momentum=0.9)
+        try:
+            #foreach batches the parameter update into a handful of multi-tensor
+            #kernels instead of one launch per parameter tensor
+            self.optimizer = optim.SGD(self.model.parameters(), lr=self.config["train"]["lr"], momentum=0.9, foreach=True)
+        except TypeError:
+            #older torch without the foreach argument
+            self.optimizer = optim.SGD(self.model.parameters(), lr=self.config["train"]["lr"], momentum=0.9)
         self.scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(self.optimizer, mode='min', 
                                                            factor=0.1, patience=10, 
                                                            verbose=False, threshold=0.0001, 
@@ -339,7 +543,7 @@ class deepforest(pl.LightningModule):
             results: tuple of (precision, recall) for a given threshold
         """
         predictions = self.predict_file(csv_file, root_dir)
-        ground_df = pd.read_csv(csv_file)
+        ground_df = self._read_csv_cached(csv_file)
         
         results = evaluate_iou.evaluate(
             predictions=predictions,
@@ -4,12 +4,66 @@ import numpy as np
 import os
 from tqdm import tqdm
 
+import rasterio
+from rasterio.windows import Window
+
 import torch
-from torchvision.ops import nms 
+from torchvision.io import read_image
+from torchvision.io.image import ImageReadMode
+from torchvision.ops import batched_nms
 
 from deepforest import preprocess
+from deepforest import utilities
 from deepforest import visualize
-from skimage import io
+
+def _prepare_image(image, device):
+    """Normalize accepted image inputs into a batched float tensor on device
+
+    Dispatches on type: paths decode straight into a CHW uint8 tensor, numpy
+    arrays convert without an intermediate float copy, and tensors pass
+    through. The /255 scaling happens after the device transfer so only the
+    compact uint8 image crosses the bus.
+
+    Args:
+        image: str path on disk, numpy (height, width, channel) array, or CHW tensor
+        device: pytorch device for prediction
+    Returns:
+        tensor: a (1, 3, height, width) float tensor scaled 0-1
+    """
+    if isinstance(image, str):
+        try:
+            tensor = read_image(image, mode=ImageReadMode.RGB)
+        except Exception:
+            #formats torchvision cannot decode, e.g. geotiff
+            tensor = torch.from_numpy(np.ascontiguousarray(utilities.read_image(image))).permute(2, 0, 1)
+    elif torch.is_tensor(image):
+        tensor = image
+    else:
+        tensor = torch.from_numpy(np.ascontiguousarray(image)).permute(2, 0, 1)
+
+    tensor = tensor.to(device)
+    if tensor.dtype == torch.float32:
+        tensor = tensor / 255
+    else:
+        tensor = tensor.to(torch.float32).div_(255)
+
+    return tensor.unsqueeze(0)
+
+def _run_inference(model, images):
+    """Run a forward pass on either the eager or a scripted model
+
+    Scripted torchvision detection models take a list of image tensors and
+    always return a (losses, detections) tuple, eager models in eval mode
+    return the detections alone.
+    """
+    if isinstance(model, torch.jit.ScriptModule):
+        if torch.is_tensor(images):
+            images = [image for image in images]
+        losses, detections = model(images)
+
+        return detections
+
+    return model(images)
 
 def predict_image(model, image, score_threshold, return_plot, device, iou_threshold=0.1):
     """Predict an image with a deepforest model
@@ -24,9 +78,11 @@ def predict_image(model, image, score_threshold, return_plot, device, iou_thresh
         boxes: A pandas dataframe of predictions (Default)
         img: The input with predictions overlaid (Optional)
     """        
-    image = preprocess.preprocess_image(image)
-    image = image.to(device)
-    prediction = model(image)
+    image = _prepare_image(image, device)
+
+    #inference_mode skips autograd bookkeeping entirely for the forward pass
+    with torch.inference_mode():
+        prediction = _run_inference(model, image)
         
     if not device.type=="cpu":
         prediction = prediction.detach().cpu().numpy()
@@ -69,12 +125,10 @@ def predict_file(model,csv_file,root_dir, savedir, device):
     
     prediction_list = []
     for path in images:
-        image = io.imread("{}/{}".format(root_dir,path))
-        image = preprocess.preprocess_image(image)
-        
         #Just predict the images, even though we have the annotations
-        image = torch.tensor(image, device=device).float()                
-        prediction = model(image)        
+        image = _prepare_image("{}/{}".format(root_dir, path), device)
+        with torch.inference_mode():
+            prediction = _run_inference(model, image)
         
         #If on gpu, bring back to cpu
         if not device.type=="cpu":
@@ -106,7 +160,8 @@ def predict_tile(model,
                  return_plot=False,
                  use_soft_nms = False,
                  sigma = 0.5,
-                 thresh = 0.001):
+                 thresh = 0.001,
+                 tile_batch_size = 8):
     """For images too large to input into the model, predict_tile cuts the
     image into overlapping windows, predicts trees on each window and
     reassambles into a single array.
@@ -123,82 +178,151 @@ def predict_tile(model,
             windows to be suppressed. Defaults to 0.5.
             Lower values suppress more boxes at edges.
         return_plot: Should the image be returned with the predictions drawn?
-        use_soft_nms: whether to perform Gaussian Soft NMS or not, if false, default perform NMS. 
+        use_soft_nms: whether to perform Gaussian Soft NMS or not, if false, default perform NMS.
         sigma: variance of Gaussian function used in Gaussian Soft NMS
         thresh: the score thresh used to filter bboxes after soft-nms performed
         device: pytorch device of 'cuda' or 'cpu' for gpu prediction. Set internally.
-    
+        tile_batch_size: number of windows to predict in a single forward pass
+
     Returns:
         boxes (array): if return_plot, an image.
         Otherwise a numpy array of predicted bounding boxes, scores and labels
     """
     
     if image is not None:
-        pass
+        src = None
+        # Compute sliding window index
+        windows = preprocess.compute_windows(image, patch_size, patch_overlap)
     else:
-        #load raster as image
-        image = io.imread(raster_path)
-    
-    # Compute sliding window index
-    windows = preprocess.compute_windows(image, patch_size, patch_overlap)
-    # Save images to tempdir
+        #Open the raster for windowed reads, each crop is read straight from
+        #disk rather than slicing a whole-raster array held in memory
+        src = rasterio.open(raster_path)
+        windows = preprocess.compute_windows_for_size(src.width, src.height,
+                                                      patch_size, patch_overlap)
+
+    # Batch windows through the model rather than one forward pass per crop,
+    # amortizing python and kernel launch overhead across the batch.
+    # Predictions stay on device until the final dataframe is built, and the
+    # whole loop plus merge runs under inference_mode so no autograd
+    # bookkeeping is allocated for intermediate tensors.
     predicted_boxes = []
-    
-    for index, window in enumerate(tqdm(windows)):
-        #crop window and predict
-        crop = image[windows[index].indices()] 
-        
-        #crop is RGB channel order, change to BGR?
-        crop = crop[...,::-1]
-        boxes = predict_image(model=model,
-                              image=crop,
-                              return_plot=False,
-                              score_threshold=score_threshold,
-                              device=device)
-        
-        #transform the coordinates to original system
-        xmin, ymin, xmax, ymax = windows[index].getRect()
-        boxes.xmin = boxes.xmin + xmin
-        boxes.xmax = boxes.xmax + xmin
-        boxes.ymin = boxes.ymin + ymin
-        boxes.ymax = boxes.ymax + ymin
-
-        predicted_boxes.append(boxes)
-    
-    predicted_boxes = pd.concat(predicted_boxes)
-    # Non-max supression for overlapping boxes among window
-    if patch_overlap == 0:
-        mosaic_df = predicted_boxes
-    else:
-        print(f"{predicted_boxes.shape[0]} predictions in overlapping windows, applying non-max supression")
-        #move prediciton to tensor 
-        boxes = torch.tensor(predicted_boxes[["xmin", "ymin", "xmax", "ymax"]].values, dtype = torch.float32)
-        scores = torch.tensor(predicted_boxes.scores.values, dtype = torch.float32)
-        labels = predicted_boxes.label.values
-        
-        if use_soft_nms == False:
-            #Performs non-maximum suppression (NMS) on the boxes according to their intersection-over-union (IoU).
-            bbox_left_idx = nms(boxes = boxes, scores = scores, iou_threshold=iou_threshold)
+    predicted_scores = []
+    predicted_labels = []
+
+    #On gpu, host-to-device copies run on their own stream from pinned
+    #staging memory so the transfer of the next batch overlaps the current
+    #batch's forward pass
+    copy_stream = torch.cuda.Stream() if device.type == "cuda" else None
+
+    def stage_batch(batch_windows):
+        """Decode a batch of windows and start their copies to device"""
+        crops = []
+        for window in batch_windows:
+            if src is not None:
+                x_offset, y_offset, width, height = window.getRect()
+                crop = src.read(indexes=[1, 2, 3],
+                                window=Window(x_offset, y_offset, width, height),
+                                out_dtype="uint8")
+                crop = np.moveaxis(crop, 0, 2)
+            else:
+                crop = image[window.indices()]
+
+            #crop is RGB channel order, change to BGR?
+            crop = crop[...,::-1]
+
+            if copy_stream is not None:
+                staging = torch.from_numpy(np.ascontiguousarray(crop)).permute(2, 0, 1).pin_memory()
+                with torch.cuda.stream(copy_stream):
+                    crops.append(staging.to(device, non_blocking=True).to(torch.float32).div_(255))
+            else:
+                crops.append(_prepare_image(crop, device).squeeze(0))
+
+        return crops
+
+    with torch.inference_mode():
+        batch_starts = range(0, len(windows), tile_batch_size)
+        next_crops = stage_batch(windows[0:tile_batch_size])
+
+        for start in tqdm(batch_starts):
+            batch_windows = windows[start:start + tile_batch_size]
+            crops = next_crops
+
+            if copy_stream is not None:
+                torch.cuda.current_stream().wait_stream(copy_stream)
+                for crop in crops:
+                    crop.record_stream(torch.cuda.current_stream())
+
+            #stage the next batch before the forward so its copy overlaps compute
+            next_windows = windows[start + tile_batch_size:start + 2 * tile_batch_size]
+            if next_windows:
+                next_crops = stage_batch(next_windows)
+
+            predictions = _run_inference(model, crops)
+
+            for window, prediction in zip(batch_windows, predictions):
+                boxes = prediction["boxes"]
+                scores = prediction["scores"]
+                labels = prediction["labels"]
+
+                keep = scores > score_threshold
+                boxes, scores, labels = boxes[keep], scores[keep], labels[keep]
+
+                #transform the coordinates to original system
+                x_offset, y_offset, _, _ = window.getRect()
+                boxes = boxes + boxes.new_tensor([x_offset, y_offset, x_offset, y_offset])
+
+                predicted_boxes.append(boxes)
+                predicted_scores.append(scores)
+                predicted_labels.append(labels)
+
+        boxes = torch.cat(predicted_boxes)
+        scores = torch.cat(predicted_scores)
+        labels = torch.cat(predicted_labels)
+
+        # Non-max supression for overlapping boxes among window
+        if patch_overlap == 0:
+            mosaic_df = pd.DataFrame({
+                "xmin": boxes[:, 0].cpu().numpy(),
+                "ymin": boxes[:, 1].cpu().numpy(),
+                "xmax": boxes[:, 2].cpu().numpy(),
+                "ymax": boxes[:, 3].cpu().numpy(),
+                "label": labels.cpu().numpy(),
+                "scores": scores.cpu().numpy()
+            })
         else:
-            #Performs soft non-maximum suppression (soft-NMS) on the boxes.
-            bbox_left_idx = soft_nms(boxes = boxes, scores = scores, sigma = sigma, thresh=thresh)
-        
-        bbox_left_idx = bbox_left_idx.numpy()
-        new_boxes, new_labels, new_scores = boxes[bbox_left_idx].type(torch.int), labels[bbox_left_idx], scores[bbox_left_idx]
-        
-        #Recreate box dataframe
-        image_detections = np.concatenate([
-                new_boxes,
-                np.expand_dims(new_labels, axis=1),
-                np.expand_dims(new_scores, axis=1)
-                ],axis=1)
-        
-        mosaic_df = pd.DataFrame(
-                image_detections,
-                columns=["xmin", "ymin", "xmax", "ymax", "label","score"])
+            print(f"{boxes.shape[0]} predictions in overlapping windows, applying non-max supression")
+
+            if use_soft_nms == False:
+                #Performs non-maximum suppression (NMS) on the boxes according to their intersection-over-union (IoU).
+                bbox_left_idx = batched_nms(boxes = boxes, scores = scores, idxs = labels, iou_threshold=iou_threshold)
+            else:
+                #Performs soft non-maximum suppression (soft-NMS) on the boxes.
+                #soft-NMS is a sequential per-box loop, run it on cpu rather
+                #than paying a host-device sync and tiny kernel launches per box
+                bbox_left_idx = soft_nms(boxes = boxes.cpu(), scores = scores.cpu(),
+                                         sigma = sigma, thresh = thresh).to(boxes.device)
+
+            new_boxes, new_labels, new_scores = boxes[bbox_left_idx].type(torch.int), labels[bbox_left_idx], scores[bbox_left_idx]
 
-        print(f"{mosaic_df.shape[0]} predictions kept after non-max suppression")
+            #Recreate box dataframe, moving to cpu only once the merge is complete
+            image_detections = np.concatenate([
+                    new_boxes.cpu().numpy(),
+                    np.expand_dims(new_labels.cpu().numpy(), axis=1),
+                    np.expand_dims(new_scores.cpu().numpy(), axis=1)
+                    ],axis=1)
+
+            mosaic_df = pd.DataFrame(
+                    image_detections,
+                    columns=["xmin", "ymin", "xmax", "ymax", "label","score"])
+
+            print(f"{mosaic_df.shape[0]} predictions kept after non-max suppression")
     
+    if src is not None:
+        if return_plot:
+            #plotting needs the full raster, read it only in that case
+            image = np.moveaxis(src.read(indexes=[1, 2, 3]), 0, 2)
+        src.close()
+
     if return_plot:
         # Draw predictions
         plot, _ = visualize.plot_predictions(image, mosaic_df)
@@ -223,10 +347,10 @@ def soft_nms(boxes,scores,sigma = 0.5, thresh = 0.001):
     '''
     # indexes concatenate boxes with the last column
     N = boxes.shape[0]
-    indexes = torch.arange(0, N, dtype=torch.float).view(N, 1)
+    indexes = torch.arange(0, N, dtype=torch.float, device=boxes.device).view(N, 1)
 
     boxes = torch.cat((boxes, indexes), dim=1)
-
+    scores = scores.clone()
 
     # The order of boxes coordinate is [x1,y1,y2,x2]
     x1 = boxes[:, 0]
@@ -247,15 +371,16 @@ def soft_nms(boxes,scores,sigma = 0.5, thresh = 0.001):
                 scores[i], scores[maxpos.item() + i + 1] = scores[maxpos.item() + i + 1].clone(), scores[i].clone()
                 areas[i], areas[maxpos + i + 1] = areas[maxpos + i + 1].clone(), areas[i].clone()
 
-        # IoU calculate
-        xx1 = np.maximum(boxes[i, 0].numpy(), boxes[pos:, 0].numpy())
-        yy1 = np.maximum(boxes[i, 1].numpy(), boxes[pos:, 1].numpy())
-        xx2 = np.minimum(boxes[i, 2].numpy(), boxes[pos:, 2].numpy())
-        yy2 = np.minimum(boxes[i, 3].numpy(), boxes[pos:, 3].numpy())
-        
-        w = np.maximum(0.0, xx2 - xx1 + 1)
-        h = np.maximum(0.0, yy2 - yy1 + 1)
-        inter = torch.tensor(w * h)
+        # IoU calculate with torch ops throughout, avoiding a numpy
+        # round-trip per iteration
+        xx1 = torch.maximum(boxes[i, 0], boxes[pos:, 0])
+        yy1 = torch.maximum(boxes[i, 1], boxes[pos:, 1])
+        xx2 = torch.minimum(boxes[i, 2], boxes[pos:, 2])
+        yy2 = torch.minimum(boxes[i, 3], boxes[pos:, 3])
+
+        w = (xx2 - xx1 + 1).clamp(min=0.0)
+        h = (yy2 - yy1 + 1).clamp(min=0.0)
+        inter = w * h
         ovr = torch.div(inter, (areas[i] + areas[pos:] - inter))
 
         # Gaussian decay
@@ -263,6 +388,6 @@ def soft_nms(boxes,scores,sigma = 0.5, thresh = 0.001):
         scores[pos:] = weight * scores[pos:]
 
     # select the boxes and keep the corresponding indexes
-    idxs_keep = boxes[:, 4][scores > thresh].int()
+    idxs_keep = boxes[:, 4][scores > thresh].long()
 
     return idxs_keep
\ No newline at end of file
@@ -49,6 +49,32 @@ def compute_windows(numpy_image, patch_size, patch_overlap):
     return (windows)
 
 
+def compute_windows_for_size(width, height, patch_size, patch_overlap):
+    """Create a sliding window object from raster dimensions alone.
+
+    Allows windows to be computed without first loading the raster into
+    memory, for use with windowed reads.
+
+    Args:
+        width (int): raster width in pixels
+        height (int): raster height in pixels
+
+    Returns:
+        windows (list): a sliding windows object
+    """
+
+    if patch_overlap > 1:
+        raise ValueError(
+            "Patch overlap {} must be between 0 - 1".format(patch_overlap))
+
+    # Generate overlapping sliding windows
+    windows = slidingwindow.generateForSize(
+        width, height, slidingwindow.DimOrder.HeightWidthChannel, patch_size,
+        patch_overlap)
+
+    return (windows)
+
+
 def select_annotations(annotations, windows, index, allow_empty=False):
     """Select annotations that overlap with selected image crop.
 
@@ -1,6 +1,7 @@
 """
 Utilities model
 """
+import functools
 import geopandas as gpd
 import json
 import numpy as np
@@ -10,6 +11,7 @@ import rasterio
 import shapely
 import torch
 import urllib
+from PIL import Image
 from tqdm import tqdm
 import xmltodict
 import warnings
@@ -29,6 +31,14 @@ def read_config(config_path):
     return config
 
 
+@functools.lru_cache(maxsize=4)
+def _cached_read_config(config_path, mtime):
+    """read_config memoized on path and modification time, so constructing
+    several models reuses one yaml parse. Callers should deep copy the result
+    before mutating it."""
+    return read_config(config_path)
+
+
 class DownloadProgressBar(tqdm):
     """Download progress bar class."""
     def update_to(self, b=1, bsize=1, tsize=None):
@@ -272,5 +282,77 @@ def project_boxes(df, root_dir, transform = True):
     return df
 
 
-def collate_fn(batch):
-    return tuple(zip(*batch))
\ No newline at end of file
+def read_image(path):
+    """Read an RGB image from disk into a numpy array
+
+    Decoding goes through PIL, so installing Pillow-SIMD against libjpeg-turbo
+    (pip uninstall pillow; CC="cc -mavx2" pip install pillow-simd) accelerates
+    jpeg/png decode without any code change. Formats PIL cannot open fall back
+    to skimage.
+
+    Args:
+        path (str): path to image on disk
+    Returns:
+        image: a (height, width, 3) numpy array
+    """
+    try:
+        with Image.open(path) as image:
+            return np.asarray(image.convert("RGB"))
+    except Exception:
+        from skimage import io
+        return io.imread(path)
+
+
+def suggest_workers(maximum=8):
+    """Suggest a dataloader worker count from the cpus available to this process
+
+    Args:
+        maximum: upper bound on the suggestion, more workers than this rarely helps and can regress throughput
+    Returns:
+        workers (int): suggested number of dataloader workers
+    """
+    try:
+        available_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # sched_getaffinity is linux only
+        available_cpus = os.cpu_count() or 1
+
+    return min(available_cpus, maximum)
+
+
+class TreeBatch:
+    """Container for a collated batch of (path, image, targets) samples.
+
+    DataLoader pin_memory only recognizes tensors and the standard python containers,
+    so the custom collate tuple would silently skip pinning. This wrapper exposes a
+    pin_memory method so batches are staged in page-locked memory and can be copied
+    to the GPU asynchronously.
+    """
+    def __init__(self, paths, images, targets):
+        self.paths = paths
+        self.images = images
+        self.targets = targets
+
+    def pin_memory(self):
+        self.images = tuple(image.pin_memory() for image in self.images)
+        self.targets = tuple({key: value.pin_memory() for key, value in target.items()} for target in self.targets)
+
+        return self
+
+    def __iter__(self):
+        return iter((self.paths, self.images, self.targets))
+
+
+def fast_collate(batch):
+    """Collate (path, image, targets) samples in a single pass over the batch
+
+    Builds each field tuple directly rather than materializing intermediate
+    lists through zip(*batch), keeping per-batch python overhead minimal.
+    """
+    return TreeBatch(tuple(sample[0] for sample in batch),
+                     tuple(sample[1] for sample in batch),
+                     tuple(sample[2] for sample in batch))
+
+
+#kept for backward compatibility with external callers
+collate_fn = fast_collate
\ No newline at end of file
@@ -65,6 +65,15 @@ def test_predict_return_plot(m):
     plot = m.predict_image(image = image, return_plot=True)
     assert not isinstance(plot, pd.DataFrame)
             
+def test_compile_for_inference(m):
+    m.compile_for_inference()
+
+    path = get_data(path="2019_YELL_2_528000_4978000_image_crop2.png")
+    prediction = m.predict_image(path = path)
+
+    assert isinstance(prediction, pd.DataFrame)
+    assert set(prediction.columns) == {"xmin","ymin","xmax","ymax","label","scores"}
+
 def test_predict_file(m, tmpdir):
     csv_file = get_data("example.csv")
     df = m.predict_file(csv_file, root_dir = os.path.dirname(csv_file), savedir=tmpdir)
@@ -73,6 +82,16 @@ def test_predict_file(m, tmpdir):
     printed_plots = glob.glob("{}/*.png".format(tmpdir))
     assert len(printed_plots) == 1
 
+def test_predict_file_use_trainer(m):
+    csv_file = get_data("example.csv")
+    root_dir = os.path.dirname(csv_file)
+    df = m.predict_file(csv_file, root_dir = root_dir)
+    df_trainer = m.predict_file(csv_file, root_dir = root_dir, use_trainer=True)
+
+    #The lightning test loop and the direct loop should gather the same predictions
+    assert set(df_trainer.columns) == set(df.columns)
+    assert df_trainer.shape[0] == df.shape[0]
+
 def test_predict_tile(m):
     #test raster prediction 
     raster_path = get_data(path= 'OSBS_029.tif')
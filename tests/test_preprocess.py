@@ -43,6 +43,19 @@ def test_compute_windows(config, image):
     assert len(windows) == 9
 
 
+def test_compute_windows_for_size(config, image):
+    windows = preprocess.compute_windows(image, config["patch_size"],
+                                         config["patch_overlap"])
+    with rasterio.open(config["path_to_raster"]) as src:
+        size_windows = preprocess.compute_windows_for_size(
+            src.width, src.height, config["patch_size"],
+            config["patch_overlap"])
+
+    # Windows computed from dimensions alone must match the array-based windows
+    assert len(size_windows) == len(windows)
+    assert [w.getRect() for w in size_windows] == [w.getRect() for w in windows]
+
+
 def test_select_annotations(config, image):
     windows = preprocess.compute_windows(image, config["patch_size"],
                                          config["patch_overlap"])
@@ -2,6 +2,7 @@
 import numpy as np
 import os
 import pytest
+import torch
 
 from deepforest import get_data
 from deepforest import utilities
@@ -36,3 +37,33 @@ def test_float_warning(config):
     float_annotations = "tests/data/float_annotations.txt"
     annotations = utilities.xml_to_annotations(float_annotations)
     assert annotations.xmin.dtype is np.dtype('int64')
+
+
+def test_fast_collate():
+    """Batches collate into a TreeBatch that unpacks like the raw tuple"""
+    batch = [("OSBS_029.tif",
+              torch.zeros((3, 10, 10)),
+              {"boxes": torch.zeros((2, 4)), "labels": torch.zeros(2)}),
+             ("SOAP_031.tif",
+              torch.ones((3, 10, 10)),
+              {"boxes": torch.zeros((1, 4)), "labels": torch.zeros(1)})]
+
+    collated = utilities.fast_collate(batch)
+    path, images, targets = collated
+
+    assert path == ("OSBS_029.tif", "SOAP_031.tif")
+    assert len(images) == 2
+    assert torch.equal(images[1], batch[1][1])
+    assert targets[0]["boxes"].shape == (2, 4)
+    assert targets[1]["labels"].shape == (1,)
+
+    # pinning must return the same structure. Like the dataloader, only
+    # exercised when cuda is present, pin_memory errors on cpu-only builds
+    if torch.cuda.is_available():
+        pinned = collated.pin_memory()
+        path, images, targets = pinned
+        assert len(images) == 2
+        assert targets[0]["boxes"].shape == (2, 4)
+
+    # collate_fn remains an alias for external callers
+    assert utilities.collate_fn is utilities.fast_collate